@@ -1,33 +1,85 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
+from environs import Env
+
+env = Env()
+env.read_env()
+
+# Motor ejecuta pymongo en un ThreadPoolExecutor cuyo tamaño se fija al importar
+# el módulo. El valor por defecto (5 * CPUs) añade contención por el GIL con
+# ráfagas de peticiones; unos pocos hilos dan mejor latencia. Se fija después de
+# leer el .env para que un MOTOR_MAX_WORKERS definido allí tenga prioridad.
+os.environ.setdefault("MOTOR_MAX_WORKERS", "4")
+
+# pylint: disable=wrong-import-position
 import cloudinary
 import cloudinary.uploader
 from cloudinary.exceptions import Error as CloudinaryError
+import httpx
 import motor.motor_asyncio as motor
+import bson
+import redis.asyncio as aioredis
 import requests
 from bson import ObjectId
-from environs import Env
 from fastapi import (
     Depends,
     FastAPI,
     File,
     Form,
     HTTPException,
+    Query,
     Request,
     UploadFile,
 )
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import ORJSONResponse, RedirectResponse, HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
 from google.auth.transport import requests as google_requests
 from google.oauth2 import id_token
-from starlette.middleware.sessions import SessionMiddleware
+from starsessions import (
+    SessionAutoloadMiddleware,
+    SessionMiddleware,
+    get_session_handler,
+    regenerate_session_id,
+)
+from starsessions.stores.redis import RedisStore
 
-env = Env()
-env.read_env()
+from batcher import InsertBatcher
 
 MONGO_URI = env("MONGO_URI")
 CLIENT_ID = env("CLIENT_ID")
+REDIS_URL = env("REDIS_URL", "redis://localhost:6379/0")
+# Solo debe activarse detrás de un proxy que reescriba X-Forwarded-For (p. ej. Vercel);
+# si no, todos los clientes comparten la IP del proxy o pueden falsear la cabecera.
+TRUST_PROXY_HEADERS = env.bool("TRUST_PROXY_HEADERS", False)
+
+GEOCODE_CACHE_TTL = 30 * 86400
+REVIEWS_CACHE_TTL = 30
+REVIEWS_CACHE_VERSION_KEY = "reviews:list:version"
+SESSION_LIFETIME = 6 * 3600
+RATE_LIMIT_WINDOW = 60
+# Mínimo que admite Cloudinary: con imágenes de hasta MAX_IMAGE_BYTES, cada
+# subida mantiene en memoria como mucho la mitad del archivo
+CLOUDINARY_CHUNK_SIZE = 5 * 1024 * 1024
+INSERT_BATCH_SIZE = 100
+INSERT_BATCH_DELAY = 0.01
+MAX_REVIEW_IMAGES = 10
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+# Política de uso de Nominatim: como máximo una petición por segundo
+NOMINATIM_MIN_INTERVAL = 1.0
+REVIEWS_PAGE_SIZE = 50
+REVIEWS_MAX_PAGE_SIZE = 200
+# Acota el $skip para que page * page_size siempre quepa en un int64 de BSON
+REVIEWS_MAX_PAGE = 10_000
+
+logger = logging.getLogger(__name__)
 
 cloudinary.config(
     cloud_name=env("CLOUDINARY_CLOUD_NAME"),
@@ -42,9 +94,77 @@ client = motor.AsyncIOMotorClient(MONGO_URI)
 db = client["Parcial2"]
 reviews_collection = db["Resenas"]
 
-app = FastAPI()
+# Campos que se leen de cada reseña; el resto (p. ej. tokens antiguos) no viaja por la red
+REVIEW_FIELDS = (
+    "_id",
+    "name",
+    "address",
+    "latitude",
+    "longitude",
+    "rating",
+    "author_email",
+    "author_name",
+    "images",
+    "created_at",
+)
+REVIEW_PROJECTION = {field: 1 for field in REVIEW_FIELDS}
+# Las reseñas sin imágenes llegan con una lista vacía en lugar de sin el campo
+REVIEW_PROJECTION["images"] = {"$ifNull": ["$images", []]}
+
+# --- Caché ---
+redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
 
-app.add_middleware(SessionMiddleware, secret_key="SUPER_SECRET_KEY_RANDOM")
+
+# --- Escrituras en lote ---
+review_inserts = InsertBatcher(reviews_collection, INSERT_BATCH_SIZE, INSERT_BATCH_DELAY)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# --- Límite de peticiones por IP ---
+# Contadores locales que se usan solo mientras Redis no está disponible
+local_rate_window = 0
+local_rate_hits: Dict[str, int] = {}
+
+# --- Cliente HTTP (Google) ---
+# Sesión compartida para reutilizar la conexión HTTPS al descargar los certificados
+google_auth_request = google_requests.Request(session=requests.Session())
+
+# --- Cliente HTTP (geocodificación) ---
+geo_client: Optional[httpx.AsyncClient] = None
+geo_lock = asyncio.Lock()
+geo_last_request = 0.0
+
+
+@app.on_event("startup")
+async def startup():
+    global geo_client
+    geo_client = httpx.AsyncClient(
+        http2=True,
+        timeout=10,
+        headers={"User-Agent": "ReViews/1.0"},
+        limits=httpx.Limits(max_keepalive_connections=20),
+    )
+    await reviews_collection.create_index([("created_at", -1)])
+    review_inserts.start()
+    if not bson.has_c():
+        logger.warning("pymongo se ejecuta sin la extensión C de BSON; la decodificación será más lenta")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await review_inserts.stop()
+    if geo_client is not None:
+        await geo_client.aclose()
+    await redis_client.aclose()
+
+# La cookie solo lleva el identificador; los datos de sesión viven en Redis
+app.add_middleware(SessionAutoloadMiddleware)
+app.add_middleware(
+    SessionMiddleware,
+    store=RedisStore(connection=redis_client, prefix="session:"),
+    cookie_name="ssid",
+    lifetime=SESSION_LIFETIME,
+)
 
 templates = Jinja2Templates(directory="templates")
 
@@ -62,9 +182,53 @@ def parse_session_datetime(value: Optional[datetime]) -> Optional[datetime]:
     return None
 
 
+def token_expired(request: Request) -> bool:
+    exp_ts = request.session.get("token_exp_ts")
+    if exp_ts is None:
+        # Sesiones creadas antes de guardar la marca de tiempo
+        token_exp = parse_session_datetime(request.session.get("token_exp"))
+        exp_ts = token_exp.timestamp() if token_exp else None
+    return exp_ts is not None and time.time() >= exp_ts
+
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "desconocido"
+
+
+def rate_limit(scope: str, limit: int):
+    async def check(request: Request):
+        global local_rate_window
+        window = int(time.time() // RATE_LIMIT_WINDOW)
+        key = f"ratelimit:{scope}:{client_ip(request)}:{window}"
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.incr(key)
+                pipe.expire(key, RATE_LIMIT_WINDOW)
+                hits, _ = await pipe.execute()
+        except aioredis.RedisError as exc:
+            logger.warning("Redis no disponible para el límite de peticiones: %s", exc)
+            if window != local_rate_window:
+                local_rate_window = window
+                local_rate_hits.clear()
+            hits = local_rate_hits[key] = local_rate_hits.get(key, 0) + 1
+
+        if hits > limit:
+            retry_after = RATE_LIMIT_WINDOW - int(time.time()) % RATE_LIMIT_WINDOW
+            raise HTTPException(
+                status_code=429,
+                detail="Demasiadas peticiones, inténtalo más tarde",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+    return check
+
+
 def get_session_user(request: Request):
-    token_exp = parse_session_datetime(request.session.get("token_exp"))
-    if token_exp and datetime.now(timezone.utc) >= token_exp:
+    if token_expired(request):
         request.session.clear()
         return None
     return request.session.get("user")
@@ -73,49 +237,62 @@ def get_session_user(request: Request):
 def require_user(request: Request):
     user = request.session.get("user")
     token = request.session.get("token")
-    token_exp = parse_session_datetime(request.session.get("token_exp"))
 
     if not user or not token:
         raise HTTPException(status_code=401, detail="No autenticado")
     
-    if token_exp and datetime.now(timezone.utc) >= token_exp:
+    if token_expired(request):
         request.session.clear()
         raise HTTPException(status_code=401, detail="Token OAuth caducado")
 
-    return {
-        **user,
-        "token": token,
-        "iat": parse_session_datetime(request.session.get("token_iat")),
-        "exp": token_exp,
-    }
+    return user
 
 
-def geocode_address(address: str):
+async def geocode_address(address: str):
+    key = "geo:" + address.strip().lower()
+    try:
+        cached = await redis_client.get(key)
+    except aioredis.RedisError as exc:
+        logger.warning("Redis no disponible para leer la geocodificación: %s", exc)
+        cached = None
+    if cached:
+        lat, lon = json.loads(cached)
+        return lat, lon
+
     url = "https://nominatim.openstreetmap.org/search"
     params = {"q": address, "format": "json", "limit": 1}
-    headers = {"User-Agent": "ReViews/1.0"}
-    try:
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-    except requests.RequestException as exc:  # pylint: disable=broad-except
-        raise HTTPException(
-            status_code=502, detail="No se pudo contactar con el servicio de geocodificación"
-        ) from exc
+    global geo_last_request
+    async with geo_lock:
+        loop = asyncio.get_running_loop()
+        wait = geo_last_request + NOMINATIM_MIN_INTERVAL - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            response = await geo_client.get(url, params=params)
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            raise HTTPException(
+                status_code=502, detail="No se pudo contactar con el servicio de geocodificación"
+            ) from exc
+        finally:
+            geo_last_request = loop.time()
     data = response.json()
 
     if not data:
         return None, None
 
-    return float(data[0]["lat"]), float(data[0]["lon"])
+    lat, lon = float(data[0]["lat"]), float(data[0]["lon"])
+    try:
+        await redis_client.setex(key, GEOCODE_CACHE_TTL, json.dumps([lat, lon]))
+    except aioredis.RedisError as exc:
+        logger.warning("Redis no disponible para guardar la geocodificación: %s", exc)
+    return lat, lon
 
 
 def serialize_review(doc: dict) -> dict:
-    def _iso(value):
-        if isinstance(value, datetime):
-            return value.isoformat()
-        return value
+    created_at = doc.get("created_at")
     return {
-        "id": str(doc.get("_id")),
+        "id": str(doc["_id"]),
         "name": doc.get("name"),
         "address": doc.get("address"),
         "latitude": doc.get("latitude"),
@@ -123,14 +300,103 @@ def serialize_review(doc: dict) -> dict:
         "rating": doc.get("rating"),
         "author_email": doc.get("author_email"),
         "author_name": doc.get("author_name"),
-        "token": doc.get("token"),
-        "token_issued_at": _iso(doc.get("token_issued_at")),
-        "token_expires_at": _iso(doc.get("token_expires_at")),
-        "images": doc.get("images", []),
-        "created_at": _iso(doc.get("created_at")),
+        "images": doc["images"],
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
     }
 
 
+async def query_reviews_page(
+    page: int, page_size: int, selected_oid: Optional[ObjectId]
+) -> Tuple[List[dict], Optional[dict]]:
+    # Un solo aggregate devuelve la página y, vía $unionWith, la reseña
+    # seleccionada. A diferencia de $facet, el $sort inicial sí usa el índice
+    # de created_at y el $match por _id usa el índice primario.
+    pipeline = [
+        {"$sort": {"created_at": -1}},
+        {"$skip": page * page_size},
+        # Una fila de más indica si existe una página siguiente
+        {"$limit": page_size + 1},
+        {"$project": REVIEW_PROJECTION},
+    ]
+    if selected_oid is not None:
+        pipeline.append(
+            {
+                "$unionWith": {
+                    "coll": reviews_collection.name,
+                    "pipeline": [
+                        {"$match": {"_id": selected_oid}},
+                        {"$project": REVIEW_PROJECTION},
+                        {"$addFields": {"_selected": True}},
+                    ],
+                }
+            }
+        )
+    docs = await reviews_collection.aggregate(pipeline).to_list(length=page_size + 2)
+
+    reviews: List[dict] = []
+    selected_review = None
+    for doc in docs:
+        if doc.get("_selected"):
+            selected_review = serialize_review(doc)
+        else:
+            reviews.append(serialize_review(doc))
+    return reviews, selected_review
+
+
+async def load_reviews_page(
+    page: int, page_size: int, selected_oid: Optional[ObjectId]
+) -> Tuple[List[dict], Optional[dict]]:
+    # La clave incluye una versión que se incrementa al crear reseñas,
+    # de modo que invalidar no requiere borrar cada página cacheada.
+    cache_key = None
+    try:
+        version = await redis_client.get(REVIEWS_CACHE_VERSION_KEY) or "0"
+        cache_key = f"reviews:list:v={version}:p={page}:s={page_size}"
+        cached = await redis_client.get(cache_key)
+    except aioredis.RedisError as exc:
+        logger.warning("Redis no disponible para leer el listado de reseñas: %s", exc)
+        cached = None
+    if cached:
+        return json.loads(cached), await find_review(selected_oid)
+
+    reviews, selected_review = await query_reviews_page(page, page_size, selected_oid)
+
+    if cache_key:
+        try:
+            await redis_client.setex(
+                cache_key, REVIEWS_CACHE_TTL, json.dumps(reviews, default=str)
+            )
+        except aioredis.RedisError as exc:
+            logger.warning("Redis no disponible para guardar el listado de reseñas: %s", exc)
+    return reviews, selected_review
+
+
+async def find_review(review_oid: Optional[ObjectId]) -> Optional[dict]:
+    if review_oid is None:
+        return None
+    db_review = await reviews_collection.find_one({"_id": review_oid}, REVIEW_PROJECTION)
+    return serialize_review(db_review) if db_review else None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match admite "*" o una lista de etiquetas separadas por comas;
+    # la comparación es débil, así que se ignora el prefijo W/.
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags:
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.removeprefix("W/") == opaque for tag in tags)
+
+
+async def invalidate_reviews_cache():
+    try:
+        await redis_client.incr(REVIEWS_CACHE_VERSION_KEY)
+    except aioredis.RedisError as exc:
+        logger.warning("Redis no disponible para invalidar el listado de reseñas: %s", exc)
+
+
 def parse_token_times(id_info: dict):
     issued = id_info.get("iat")
     expires = id_info.get("exp")
@@ -143,39 +409,113 @@ def parse_token_times(id_info: dict):
     return issued_dt, expires_dt
 
 
-def upload_images(files: Optional[List[UploadFile]]) -> List[str]:
+def is_image(header: bytes) -> bool:
+    return (
+        header.startswith(b"\xff\xd8\xff")  # JPEG
+        or header.startswith(b"\x89PNG\r\n\x1a\n")
+        or header[:6] in (b"GIF87a", b"GIF89a")
+        or (header[:4] == b"RIFF" and header[8:12] == b"WEBP")
+    )
+
+
+async def validate_images(files: Optional[List[UploadFile]]) -> None:
+    # Se comprueba todo antes de la primera subida para no gastar
+    # ancho de banda de Cloudinary en peticiones que acabarán rechazadas.
+    files = [file for file in files or [] if file and file.filename]
+    if len(files) > MAX_REVIEW_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Se permiten como máximo {MAX_REVIEW_IMAGES} imágenes por reseña",
+        )
+
+    for file in files:
+        size = file.size
+        if size is None:
+            file.file.seek(0, os.SEEK_END)
+            size = file.file.tell()
+            file.file.seek(0)
+        if size > MAX_IMAGE_BYTES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"La imagen {file.filename} supera el tamaño máximo permitido",
+            )
+
+        header = await file.read(16)
+        await file.seek(0)
+        if not is_image(header):
+            raise HTTPException(
+                status_code=400, detail=f"El archivo {file.filename} no es una imagen válida"
+            )
+
+
+async def delete_images(uploaded: List[dict]):
+    # Borra de Cloudinary subidas que no han llegado a asociarse a una reseña
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                None,
+                functools.partial(
+                    cloudinary.uploader.destroy,
+                    result["public_id"],
+                    resource_type=result.get("resource_type", "image"),
+                ),
+            )
+            for result in uploaded
+        ],
+        return_exceptions=True,
+    )
+    for result, outcome in zip(uploaded, results):
+        if isinstance(outcome, BaseException):
+            logger.warning(
+                "No se pudo borrar la imagen huérfana %s: %s", result["public_id"], outcome
+            )
+
+
+async def upload_images(files: Optional[List[UploadFile]]) -> List[dict]:
     if not files:
         return []
 
-    uploaded_urls: List[str] = []
-    for file in files:
-        if not file or not file.filename:
-            continue
-        try:
-            result = cloudinary.uploader.upload(
+    loop = asyncio.get_running_loop()
+    tasks = [
+        loop.run_in_executor(
+            None,
+            functools.partial(
+                cloudinary.uploader.upload_large,
                 file.file,
+                chunk_size=CLOUDINARY_CHUNK_SIZE,
                 folder="reviews",
                 resource_type="auto",
-            )
-        except CloudinaryError as exc:  # pylint: disable=broad-except
+            ),
+        )
+        for file in files
+        if file and file.filename
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    uploaded = [result for result in results if not isinstance(result, BaseException)]
+    error = next((result for result in results if isinstance(result, BaseException)), None)
+    if error is not None:
+        # Si falla una subida no se crea la reseña, así que se borran las demás
+        await delete_images(uploaded)
+        if isinstance(error, CloudinaryError):
             raise HTTPException(
                 status_code=502, detail="No se pudieron subir las imágenes a Cloudinary"
-            ) from exc
-        secure_url = result.get("secure_url")
-        if secure_url:
-            uploaded_urls.append(secure_url)
-    return uploaded_urls
+            ) from error
+        raise error
+    return uploaded
 
 
-@app.post("/login")
+@app.post("/login", dependencies=[Depends(rate_limit("login", 10))])
 async def login(data: dict, request: Request):
     token = data.get("token")
     if not token:
         raise HTTPException(status_code=400, detail="Token requerido")
     try:
-        id_info = id_token.verify_oauth2_token(
+        id_info = await asyncio.to_thread(
+            id_token.verify_oauth2_token,
             token,
-            google_requests.Request(),
+            google_auth_request,
             CLIENT_ID
         )
     except Exception as exc:  # pylint: disable=broad-except
@@ -189,10 +529,18 @@ async def login(data: dict, request: Request):
         "picture": id_info.get("picture"),
     }
 
+    # Se borra la sesión anterior de Redis y se emite un identificador nuevo
+    # para evitar la fijación de sesión
+    handler = get_session_handler(request)
+    if handler.session_id:
+        await handler.destroy()
+    request.session.clear()
+    regenerate_session_id(request)
     request.session["user"] = user_info
     request.session["token"] = token
     request.session["token_iat"] = issued_dt.isoformat() if issued_dt else None
     request.session["token_exp"] = expires_dt.isoformat() if expires_dt else None
+    request.session["token_exp_ts"] = expires_dt.timestamp() if expires_dt else None
         
     return RedirectResponse(url='/reviews', status_code=303)
 
@@ -200,6 +548,7 @@ async def login(data: dict, request: Request):
 
 @app.get("/logout")
 async def logout(request: Request):
+    # Con la sesión vacía el middleware borra su clave de Redis
     request.session.clear()
     return RedirectResponse(url="/", status_code=303)
 
@@ -217,23 +566,34 @@ async def home(request: Request, user: dict = Depends(get_session_user)):
 async def list_reviews(
     request: Request,
     selected: Optional[str] = None,
+    page: int = Query(0, ge=0, le=REVIEWS_MAX_PAGE),
+    page_size: int = Query(REVIEWS_PAGE_SIZE, ge=1, le=REVIEWS_MAX_PAGE_SIZE),
     user: dict = Depends(require_user),
 ):
-    reviews: List[dict] = []
-    cursor = reviews_collection.find().sort("created_at", -1)
-    async for doc in cursor:
-        reviews.append(serialize_review(doc))
-
-    selected_review = None
-    if selected:
-        selected_review = next((r for r in reviews if r["id"] == selected), None)
-        if not selected_review:
-            try:
-                db_review = await reviews_collection.find_one({"_id": ObjectId(selected)})
-                if db_review:
-                    selected_review = serialize_review(db_review)
-            except Exception:
-                selected_review = None
+    try:
+        selected_oid = ObjectId(selected) if selected else None
+    except Exception:  # pylint: disable=broad-except
+        selected_oid = None
+
+    reviews, selected_review = await load_reviews_page(page, page_size, selected_oid)
+    has_next = len(reviews) > page_size
+    reviews = reviews[:page_size]
+
+    # Las reseñas no se editan, así que sus ids junto con la selección, la página
+    # y el usuario identifican por completo el HTML generado.
+    etag_source = [r["id"] for r in reviews] + [
+        selected_review["id"] if selected_review else None,
+        page,
+        page_size,
+        has_next,
+        user.get("email"),
+        user.get("name"),
+        user.get("picture"),
+    ]
+    etag = 'W/"%s"' % hashlib.md5(json.dumps(etag_source).encode()).hexdigest()
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
 
     return templates.TemplateResponse(
         "mapa.html",
@@ -242,11 +602,19 @@ async def list_reviews(
             "user": user,
             "reviews": reviews,
             "selected_review": selected_review,
+            "page": page,
+            "page_size": page_size,
+            "has_next": has_next,
         },
+        headers=cache_headers,
     )
 
 
-@app.post("/reviews", response_class=RedirectResponse)
+@app.post(
+    "/reviews",
+    response_class=RedirectResponse,
+    dependencies=[Depends(rate_limit("reviews", 5))],
+)
 async def create_review(
     name: str = Form(...),
     address: str = Form(...),
@@ -257,12 +625,26 @@ async def create_review(
     if rating < 0 or rating > 5:
         raise HTTPException(status_code=400, detail="La valoración debe estar entre 0 y 5")
 
-    lat, lon = geocode_address(address)
-    
+    await validate_images(images)
+
+    geocoded, uploaded = await asyncio.gather(
+        geocode_address(address), upload_images(images), return_exceptions=True
+    )
+    if isinstance(uploaded, BaseException):
+        # upload_images ya ha borrado sus propias subidas parciales
+        raise uploaded
+
+    # Las imágenes se suben en paralelo con la geocodificación, así que si
+    # esta falla hay que borrarlas para no dejarlas huérfanas en Cloudinary.
+    if isinstance(geocoded, BaseException):
+        await delete_images(uploaded)
+        raise geocoded
+    lat, lon = geocoded
     if lat is None or lon is None:
+        await delete_images(uploaded)
         raise HTTPException(status_code=400, detail="No se pudo geocodificar la dirección")
 
-    uploaded_urls = upload_images(images)
+    uploaded_urls = [result["secure_url"] for result in uploaded if result.get("secure_url")]
 
     review_doc = {
         "name": name,
@@ -272,15 +654,16 @@ async def create_review(
         "rating": rating,
         "author_email": user["email"],
         "author_name": user.get("name"),
-        "token": user.get("token"),
-        "token_issued_at": user.get("iat"),
-        "token_expires_at": user.get("exp"),
         "images": uploaded_urls,
         "created_at": datetime.now(timezone.utc),
     }
     
-    result = await reviews_collection.insert_one(review_doc)
-    review_id = str(result.inserted_id)
+    try:
+        review_id = str(await review_inserts.insert(review_doc))
+    except Exception:
+        await delete_images(uploaded)
+        raise
+    await invalidate_reviews_cache()
 
     return RedirectResponse(url=f"/reviews?selected={review_id}", status_code=303)
 
@@ -288,7 +671,9 @@ async def create_review(
 @app.get("/reviews/{review_id}")
 async def get_review(review_id: str, user: dict = Depends(require_user)):
     try:
-         db_review = await reviews_collection.find_one({"_id": ObjectId(review_id)})
+         db_review = await reviews_collection.find_one(
+             {"_id": ObjectId(review_id)}, REVIEW_PROJECTION
+         )
     except Exception as exc:  # pylint: disable=broad-except
         raise HTTPException(status_code=400, detail="Identificador inválido") from exc
 
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class InsertBatcher:
+    """Agrupa las inserciones que llegan en una ventana corta en un solo bulk_write."""
+
+    def __init__(self, collection, max_size: int, max_delay: float):
+        self.collection = collection
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # Lo que ya esté en la cola se escribe antes del centinela
+        await self._queue.put(None)
+        await task
+
+    async def insert(self, doc: dict) -> ObjectId:
+        if not self.running:
+            raise RuntimeError("El InsertBatcher no está en marcha")
+        # El _id se genera aquí para no depender del resultado del bulk_write
+        doc.setdefault("_id", ObjectId())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((doc, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._flush(batch)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error inesperado al escribir un lote de inserciones")
+
+    async def _flush(self, batch):
+        failed = {}
+        try:
+            await self.collection.bulk_write(
+                [InsertOne(doc) for doc, _ in batch], ordered=False
+            )
+        except BulkWriteError as exc:
+            failed = {err["index"]: exc for err in exc.details.get("writeErrors", [])}
+        except asyncio.CancelledError:
+            error = RuntimeError("Escritura del lote cancelada")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            failed = {index: exc for index in range(len(batch))}
+
+        for index, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(doc["_id"])
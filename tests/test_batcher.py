@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+from bson.errors import InvalidDocument
+
+from batcher import InsertBatcher
+
+
+class FakeCollection:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    async def bulk_write(self, ops, ordered):
+        self.calls.append(len(ops))
+        if self.error is not None:
+            raise self.error
+
+
+def test_insert_groups_documents_in_one_bulk_write():
+    async def scenario():
+        collection = FakeCollection()
+        batcher = InsertBatcher(collection, max_size=100, max_delay=0.01)
+        batcher.start()
+        ids = await asyncio.gather(*[batcher.insert({"n": n}) for n in range(5)])
+        await batcher.stop()
+        return collection, ids
+
+    collection, ids = asyncio.run(scenario())
+    assert collection.calls == [5]
+    assert len(set(ids)) == 5
+
+
+def test_flush_error_fails_pending_inserts_and_keeps_running():
+    async def scenario():
+        collection = FakeCollection(error=InvalidDocument("documento inválido"))
+        batcher = InsertBatcher(collection, max_size=100, max_delay=0.01)
+        batcher.start()
+        results = await asyncio.wait_for(
+            asyncio.gather(batcher.insert({}), batcher.insert({}), return_exceptions=True),
+            timeout=1,
+        )
+        collection.error = None
+        later = await asyncio.wait_for(batcher.insert({}), timeout=1)
+        await batcher.stop()
+        return results, later
+
+    results, later = asyncio.run(scenario())
+    assert all(isinstance(result, InvalidDocument) for result in results)
+    assert later is not None
+
+
+def test_insert_requires_running_batcher():
+    async def scenario():
+        batcher = InsertBatcher(FakeCollection(), max_size=100, max_delay=0.01)
+        with pytest.raises(RuntimeError):
+            await batcher.insert({})
+        batcher.start()
+        await batcher.stop()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(batcher.insert({}), timeout=1)
+
+    asyncio.run(scenario())